@@ -1,13 +1,26 @@
+import hashlib
+import io
 import os
+import re
+import time
+import unicodedata
+import zlib
 from datetime import datetime
 from typing import IO
 
+import fitz  # PyMuPDF
 import google.generativeai as genai
-import PyPDF2
+from celery import Celery
 from dotenv import load_dotenv
-from flask import Flask, jsonify, request
+from flask import Flask, abort, g, jsonify, request
 from flask_cors import CORS
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import LargeBinary, event, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.types import TypeDecorator
+
+from llm_cache import ResponseCache, SemanticCache, cache_key
+from retrieval import embed_text, select_relevant_text
 
 # --- CONFIGURATION & INITIALIZATION ---
 load_dotenv()
@@ -15,24 +28,66 @@ load_dotenv()
 app = Flask(__name__)
 app.config.from_mapping(
     SQLALCHEMY_DATABASE_URI='sqlite:///documents.db',
-    SQLALCHEMY_TRACK_MODIFICATIONS=False
+    SQLALCHEMY_TRACK_MODIFICATIONS=False,
+    # Room for every Gunicorn thread to hold a connection; check_same_thread=False lets pooled
+    # connections move between those threads, and pre-ping replaces connections that have gone stale
+    SQLALCHEMY_ENGINE_OPTIONS={
+        "pool_size": 10,
+        "max_overflow": 20,
+        "pool_pre_ping": True,
+        "connect_args": {"check_same_thread": False}
+    },
+    UPLOAD_FOLDER=os.path.join(app.instance_path, 'uploads')
 )
 
-CORS(app)
+CORS(app, expose_headers=["X-Cache"])
 db = SQLAlchemy(app)
 
+@event.listens_for(Engine, "connect")
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    """Enables WAL on each new SQLite connection so readers and writers don't block each other."""
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.close()
+
+response_cache = ResponseCache(redis_url=os.getenv("REDIS_URL"))
+semantic_cache = SemanticCache()
+
+# Document analysis runs on Celery workers (`celery -A app.celery_app worker --concurrency=8`).
+# Without a broker configured, tasks run inline so `python app.py` still works on its own.
+# Only CELERY_BROKER_URL enables the broker; REDIS_URL on its own just turns on the shared response cache.
+celery_broker_url = os.getenv("CELERY_BROKER_URL")
+celery_app = Celery('legalmind', broker=celery_broker_url or 'redis://localhost:6379/0')
+celery_app.conf.task_always_eager = not celery_broker_url
+
 
 # --- DATABASE MODELS ---
 
+class CompressedText(TypeDecorator):
+    """Stores text zlib-compressed, which shrinks extracted legal text several times over."""
+    impl = LargeBinary
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        return zlib.compress(value.encode("utf-8")) if value is not None else None
+
+    def process_result_value(self, value, dialect):
+        if value is None or isinstance(value, str): # Rows saved before compression was added are plain text
+            return value
+        return zlib.decompress(value).decode("utf-8")
+
 class Document(db.Model):
     """Represents an analyzed document in the database."""
     id = db.Column(db.Integer, primary_key=True)
     filename = db.Column(db.String(300), nullable=False)
-    upload_date = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    upload_date = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
     status = db.Column(db.String(50), nullable=False, default='Pending')
-    summary = db.Column(db.Text, nullable=True)
-    full_text = db.Column(db.Text, nullable=True)
+    summary = db.Column(CompressedText, nullable=True)
+    full_text = db.Column(CompressedText, nullable=True)
     model_used = db.Column(db.String(100), nullable=True) # New column to store which model was used
+    content_hash = db.Column(db.String(64), nullable=True, index=True) # sha256 of the uploaded file and prompt
 
     def to_dict(self):
         """Serializes the Document object to a dictionary."""
@@ -51,7 +106,7 @@ class HistoryEvent(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     event_type = db.Column(db.String(100), nullable=False)
     document_name = db.Column(db.String(300), nullable=False)
-    timestamp = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    timestamp = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
 
     def to_dict(self):
         """Serializes the HistoryEvent object to a dictionary."""
@@ -75,6 +130,20 @@ except Exception as e:
 
 # --- HELPER FUNCTIONS ---
 
+# Whitespace and invisible characters in extracted PDF text that only add input tokens.
+# Zero-width (non-)joiners are left alone because Indic scripts need them.
+_INVISIBLE_CHARS = re.compile('[\u00ad\u200b\u2060\ufeff]')
+_LINE_BREAKS = re.compile(r'\r\n?|[\f\v]')
+_HORIZONTAL_WHITESPACE = re.compile(r'[ \t]+')
+_LINE_EDGE_SPACES = re.compile(r' ?\n ?')
+_EXTRA_BLANK_LINES = re.compile(r'\n{3,}')
+
+# Minimum seconds between saves of a partial analysis while Gemini streams it in
+STREAM_PROGRESS_INTERVAL = 1.0
+
+# GenerativeModel instances are reused across requests, one per model name
+_MODEL_CACHE: dict[str, genai.GenerativeModel] = {}
+
 def get_gemini_model(model_name: str):
     """Dynamically gets a GenerativeModel instance based on the provided name."""
     # Ensure API key is present before attempting to get a model
@@ -90,39 +159,121 @@ def get_gemini_model(model_name: str):
         if model_name not in allowed_models:
             print(f"Warning: Invalid model '{model_name}' requested. Defaulting to 'gemini-1.5-flash'.")
             model_name = 'gemini-1.5-flash'
-        return genai.GenerativeModel(model_name)
+        model = _MODEL_CACHE.get(model_name)
+        if model is None:
+            # setdefault is atomic, so concurrent first requests still end up sharing one instance
+            model = _MODEL_CACHE.setdefault(model_name, genai.GenerativeModel(model_name))
+        return model
     except Exception as e:
         print(f"Error initializing Gemini model '{model_name}': {e}")
         # Re-raise to be caught by route handlers with more specific messages
         raise ValueError(f"Failed to initialize Gemini model '{model_name}'. Ensure API key is valid and model exists: {e}")
 
+def generate_cached(model_name: str, prompt: str, use_cache: bool = True, on_progress=None) -> str:
+    """Returns the Gemini response text for a prompt, served from the response cache when possible.
+
+    If on_progress is given, the response is streamed and on_progress is called with the
+    text received so far, at most once every STREAM_PROGRESS_INTERVAL seconds.
+    """
+    key = cache_key(model_name, prompt)
+    if use_cache:
+        cached = response_cache.get(key)
+        if cached is not None:
+            return cached
+
+    model_instance = get_gemini_model(model_name)
+    response = model_instance.generate_content(prompt, stream=on_progress is not None)
+    if on_progress is None:
+        response_text = response.text
+    else:
+        parts = []
+        last_progress = 0.0 # Report the first chunk straight away
+        for chunk in response:
+            parts.append(chunk.text)
+            if time.monotonic() - last_progress >= STREAM_PROGRESS_INTERVAL:
+                on_progress("".join(parts))
+                last_progress = time.monotonic()
+        response_text = "".join(parts)
+    response_cache.set(key, response_text)
+    return response_text
+
+def normalize_text(text: str) -> str:
+    """Collapses the redundant whitespace and invisible characters PDF extraction leaves behind."""
+    text = unicodedata.normalize('NFKC', text)
+    text = _INVISIBLE_CHARS.sub('', text)
+    text = _LINE_BREAKS.sub('\n', text)
+    text = _HORIZONTAL_WHITESPACE.sub(' ', text)
+    text = _LINE_EDGE_SPACES.sub('\n', text)
+    text = _EXTRA_BLANK_LINES.sub('\n\n', text)
+    return text.strip()
+
 def extract_text_from_pdf(file_stream: IO) -> str | None:
     """Extracts text content from a PDF file stream."""
     try:
-        reader = PyPDF2.PdfReader(file_stream)
-        text = "".join(page.extract_text() for page in reader.pages if page.extract_text())
-        return text
+        with fitz.open(stream=file_stream.read(), filetype="pdf") as doc:
+            # Write page by page instead of joining, so all pages are never held as separate strings at once
+            text = io.StringIO()
+            for page in doc:
+                text.write(page.get_text("text"))
+                text.write("\n")
+        return normalize_text(text.getvalue())
     except Exception as e:
         print(f"Error extracting text from PDF: {e}")
         return None
 
+def _update_document(doc_id: int, **values):
+    """Updates columns of a document with a single UPDATE, without loading the row."""
+    db.session.execute(Document.__table__.update().where(Document.__table__.c.id == doc_id).values(**values))
+
+def _flag_set(value) -> bool:
+    """Reads an on/off request flag such as no_cache; empty, "false" and "0" all count as off."""
+    return str(value).strip().lower() in ('1', 'true', 'yes', 'on')
+
+def _upload_path(doc_id: int) -> str:
+    """Returns where an uploaded PDF is kept until its analysis job picks it up."""
+    return os.path.join(app.config['UPLOAD_FOLDER'], f"{doc_id}.pdf")
+
+def _remove_upload(doc_id: int):
+    """Deletes a document's uploaded PDF, if it is still waiting on disk."""
+    try:
+        os.remove(_upload_path(doc_id))
+    except FileNotFoundError:
+        pass
+
 def log_event(event_type: str, document_name: str):
-    """Creates and saves a new history event to the database."""
-    event = HistoryEvent(event_type=event_type, document_name=document_name)
-    db.session.add(event)
-    db.session.commit()
+    """Queues a history event to be saved when the current request or task finishes."""
+    g.setdefault('pending_events', []).append({
+        "event_type": event_type,
+        "document_name": document_name,
+        "timestamp": datetime.utcnow()
+    })
+
+@app.teardown_appcontext
+def flush_pending_events(exc):
+    """Saves all queued history events with a single multi-row INSERT."""
+    pending_events = g.pop('pending_events', None)
+    if not pending_events:
+        return
+    try:
+        with db.engine.begin() as connection:
+            connection.execute(HistoryEvent.__table__.insert(), pending_events)
+    except Exception as e:
+        print(f"Error saving {len(pending_events)} history event(s): {e}")
 
-def _build_analysis_prompt(document_text: str, user_prompt: str) -> str:
-    """Builds the detailed analysis prompt for the Gemini API."""
-    return f"""
+# The analysis prompt template, split around the user request and the document text
+_PROMPT_HEADER = """
 **Role:** You are an expert legal analyst AI specializing in **Indian Law**.
 **Task:** Analyze the provided legal document from the perspective of **Indian law**. Your analysis must be clear, structured, and reference specific clauses. Cite relevant Indian statutes where applicable.
 
 ---
-**User's Specific Request:** "{user_prompt}"
+**User's Specific Request:** \""""
+
+_PROMPT_MIDDLE = """\"
 ---
 **Document Text:**
-{document_text}
+"""
+
+_PROMPT_FOOTER = """
 ---
 **Your Structured Analysis (Indian Legal Context):**
 
@@ -165,6 +316,11 @@ def _build_analysis_prompt(document_text: str, user_prompt: str) -> str:
 3.  **General Advice:** *(e.g., "Consult a lawyer practicing in India.")*
 """
 
+def _build_analysis_prompt(document_text: str, user_prompt: str) -> str:
+    """Builds the detailed analysis prompt for the Gemini API."""
+    # join() sizes the result once from its parts, so the document text is copied a single time
+    return "".join((_PROMPT_HEADER, user_prompt, _PROMPT_MIDDLE, document_text, _PROMPT_FOOTER))
+
 def _build_qa_prompt(document_text: str, question: str) -> str:
     """Builds the prompt for the follow-up Q&A feature."""
     return f"""
@@ -178,13 +334,70 @@ def _build_qa_prompt(document_text: str, question: str) -> str:
 """
 
 
+# --- BACKGROUND TASKS ---
+
+@celery_app.task
+def analyze_document(doc_id: int, prompt: str, model_name: str, use_cache: bool = True):
+    """Extracts a queued document's text, analyzes it with Gemini and stores the result."""
+    with app.app_context():
+        filename = db.session.execute(db.select(Document.filename).where(Document.id == doc_id)).scalar()
+        if filename is None:
+            print(f"Document {doc_id} was deleted before its analysis ran.")
+            _remove_upload(doc_id)
+            return
+
+        upload_path = _upload_path(doc_id)
+        try:
+            with open(upload_path, 'rb') as pdf_stream:
+                document_text = extract_text_from_pdf(pdf_stream)
+            os.remove(upload_path)
+        except OSError as e:
+            print(f"Error reading uploaded file for document {doc_id}: {e}")
+            document_text = None
+
+        if not document_text or not document_text.strip():
+            _update_document(doc_id, status='Analysis Failed', summary='Could not extract text from PDF.')
+            log_event("TEXT_EXTRACT_FAIL", filename)
+            db.session.commit()
+            return
+
+        # Long documents are cut down to the passages most relevant to the user's request
+        prompt_text = select_relevant_text(document_text, prompt)
+        full_prompt = _build_analysis_prompt(prompt_text, prompt)
+
+        def save_partial_summary(partial_summary: str):
+            # Progress writes are best-effort: a failed one must not abort the analysis itself
+            try:
+                _update_document(doc_id, status='In Progress', summary=partial_summary)
+                db.session.commit()
+            except Exception as e:
+                print(f"Error saving partial summary for document {doc_id}: {e}")
+                db.session.rollback()
+
+        # In eager mode the request is still waiting on this task, so nobody can poll the partial summary
+        on_progress = None if celery_app.conf.task_always_eager else save_partial_summary
+
+        # The extracted text, status and final summary are written by one UPDATE once the analysis is done
+        try:
+            summary = generate_cached(model_name, full_prompt, use_cache, on_progress=on_progress)
+            _update_document(doc_id, status='Analyzed', summary=summary, full_text=document_text)
+            log_event("ANALYSIS_SUCCESS", filename)
+        except ValueError as e: # Catch ValueError specifically for API key/model issues from get_gemini_model
+            print(f"Gemini API initialization error: {e}")
+            _update_document(doc_id, status='Analysis Failed', summary=f"API Error: {e}", full_text=document_text)
+            log_event("ANALYSIS_FAIL", filename)
+        except Exception as e: # Catch any other general exceptions during content generation
+            print(f"An error occurred during Gemini API call: {e}")
+            _update_document(doc_id, status='Analysis Failed', summary=f"Analysis failed: {e}", full_text=document_text)
+            log_event("ANALYSIS_FAIL", filename)
+        db.session.commit()
+
+
 # --- API ROUTES ---
 
 @app.route('/simplify', methods=['POST'])
 def simplify_document():
-    """Analyzes a document, saves it with its full text, and logs events."""
-    # The get_gemini_model will handle checks for API key availability.
-    
+    """Saves an uploaded document and queues it for analysis, returning a job id to poll."""
     if 'pdfFile' not in request.files: return jsonify({"error": "No PDF file provided."}), 400
     
     pdf_file = request.files['pdfFile']
@@ -192,48 +405,64 @@ def simplify_document():
 
     # Get selected model from the request, default to 'gemini-1.5-flash' if not provided
     selected_model_name = request.form.get('model', 'gemini-1.5-flash')
+    use_cache = not _flag_set(request.form.get('no_cache'))
+    prompt_from_user = request.form.get('prompt', "Provide a comprehensive analysis.")
     
     log_event("UPLOAD_SUCCESS", pdf_file.filename)
+
+    # Read the upload in one call; the bytes are reused for hashing and for saving it below
+    pdf_bytes = pdf_file.stream.read()
+
+    # The same file analyzed with the same prompt and model reuses the earlier analysis
+    content_hash = hashlib.sha256(pdf_bytes + b"\0" + prompt_from_user.encode("utf-8")).hexdigest()
+    if use_cache:
+        existing = db.session.execute(
+            db.select(Document.id, Document.summary, Document.full_text)
+            .filter_by(content_hash=content_hash, model_used=selected_model_name, status='Analyzed')
+            .limit(1)
+        ).first()
+        if existing:
+            return jsonify({
+                "job_id": existing.id,
+                "status": 'Analyzed',
+                "summary": existing.summary,
+                "document_text": existing.full_text
+            }), 200, {"X-Cache": "HIT"}
     
-    document_text = extract_text_from_pdf(pdf_file.stream)
-    
-    if not document_text or not document_text.strip():
-        failed_doc = Document(filename=pdf_file.filename, status='Analysis Failed', summary='Could not extract text from PDF.', model_used=selected_model_name)
-        db.session.add(failed_doc)
-        db.session.commit()
-        log_event("TEXT_EXTRACT_FAIL", pdf_file.filename)
-        return jsonify({"error": "Could not extract text from the PDF."}), 400
-        
-    new_doc = Document(filename=pdf_file.filename, status='In Progress', full_text=document_text, model_used=selected_model_name)
-    db.session.add(new_doc)
+    # RETURNING hands back the new id from the INSERT itself, without loading an ORM object
+    doc_id = db.session.execute(
+        Document.__table__.insert().returning(Document.__table__.c.id),
+        {"filename": pdf_file.filename, "status": 'Queued', "model_used": selected_model_name, "content_hash": content_hash}
+    ).scalar()
     db.session.commit()
-    
-    prompt_from_user = request.form.get('prompt', "Provide a comprehensive analysis.")
-    full_prompt = _build_analysis_prompt(document_text, prompt_from_user)
+
+    os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+    with open(_upload_path(doc_id), 'wb') as upload:
+        upload.write(pdf_bytes)
     
     try:
-        # Get the dynamically selected model
-        model_instance = get_gemini_model(selected_model_name)
-        response = model_instance.generate_content(full_prompt)
-        new_doc.summary = response.text
-        new_doc.status = 'Analyzed'
-        log_event("ANALYSIS_SUCCESS", new_doc.filename)
-        db.session.commit()
-        return jsonify({"summary": new_doc.summary, "document_text": document_text})
-    except ValueError as e: # Catch ValueError specifically for API key/model issues from get_gemini_model
-        print(f"Gemini API initialization error: {e}")
-        new_doc.status = 'Analysis Failed'
-        new_doc.summary = f"API Error: {e}"
-        log_event("ANALYSIS_FAIL", new_doc.filename)
-        db.session.commit()
-        return jsonify({"error": f"AI model configuration error: {e}"}), 500
-    except Exception as e: # Catch any other general exceptions during content generation
-        print(f"An error occurred during Gemini API call: {e}")
-        new_doc.status = 'Analysis Failed'
-        new_doc.summary = f"Analysis failed: {e}"
-        log_event("ANALYSIS_FAIL", new_doc.filename)
+        analyze_document.delay(doc_id, prompt_from_user, selected_model_name, use_cache)
+    except Exception as e: # The broker is unreachable, so the job will never run
+        print(f"Error queueing analysis job: {e}")
+        _update_document(doc_id, status='Analysis Failed', summary=f"Queue error: {e}")
+        log_event("ANALYSIS_FAIL", pdf_file.filename)
         db.session.commit()
-        return jsonify({"error": "Failed to get a response from the AI model. Check server logs for details."}), 500
+        return jsonify({"error": "Failed to queue the document for analysis. Check server logs for details."}), 503
+
+    return jsonify({"job_id": doc_id}), 202
+
+@app.route('/simplify/status/<int:job_id>', methods=['GET'])
+def get_simplify_status(job_id):
+    """Reports the status of a queued analysis, with its result once finished."""
+    doc = Document.query.get_or_404(job_id)
+    result = {"job_id": doc.id, "status": doc.status}
+    if doc.status == 'Analyzed':
+        result.update(summary=doc.summary, document_text=doc.full_text)
+    elif doc.status == 'In Progress':
+        result["summary"] = doc.summary # The analysis so far, while Gemini is still streaming it
+    elif doc.status == 'Analysis Failed':
+        result["error"] = doc.summary
+    return jsonify(result)
 
 @app.route('/ask', methods=['POST'])
 def ask_question():
@@ -246,20 +475,34 @@ def ask_question():
 
     # Get selected model from the request JSON, default to 'gemini-1.5-flash'
     selected_model_name = data.get('model', 'gemini-1.5-flash')
-
-    qa_prompt = _build_qa_prompt(data['document_text'], data['question'])
+    use_cache = not _flag_set(data.get('no_cache'))
+
+    # The prompt is fully determined by the document and question, so key on those before any embedding work
+    key = cache_key(selected_model_name, f"{data['document_text']}\0{data['question']}")
+    if use_cache:
+        cached = response_cache.get(key)
+        if cached is not None:
+            return jsonify({"answer": cached}), 200, {"X-Cache": "HIT"}
+
+    # Near-duplicate questions about the same document can share an answer
+    semantic_scope = cache_key(selected_model_name, data['document_text'])
+    question_embedding = embed_text(data['question'])
+    if use_cache and question_embedding is not None:
+        cached = semantic_cache.get(semantic_scope, question_embedding)
+        if cached is not None:
+            return jsonify({"answer": cached}), 200, {"X-Cache": "SEMANTIC-HIT"}
+
+    qa_context = select_relevant_text(data['document_text'], data['question'], question_embedding)
+    qa_prompt = _build_qa_prompt(qa_context, data['question'])
     
     try:
-        # Get the dynamically selected model for the chat
+        # qa_prompt already carries the document context, so a single call is enough
         model_instance = get_gemini_model(selected_model_name)
-        
-        chat = model_instance.start_chat(history=[
-            {"role": "user", "parts": [f"Here is the legal document for context:\n\n{data['document_text']}"]},
-            {"role": "model", "parts": ["Understood. I have the document context."]}
-        ])
-        
-        response = chat.send_message(qa_prompt) # Use qa_prompt here, not question directly
-        return jsonify({"answer": response.text})
+        response = model_instance.generate_content(qa_prompt)
+        response_cache.set(key, response.text)
+        if question_embedding is not None:
+            semantic_cache.set(semantic_scope, question_embedding, response.text)
+        return jsonify({"answer": response.text}), 200, {"X-Cache": "MISS"}
     except ValueError as e: # Catch ValueError specifically for API key/model issues from get_gemini_model
         print(f"Gemini API initialization error for /ask: {e}")
         return jsonify({"error": f"AI model configuration error for chat: {e}"}), 500
@@ -269,9 +512,24 @@ def ask_question():
 
 @app.route('/documents', methods=['GET'])
 def get_documents():
-    """Retrieves all documents from the database."""
-    documents = Document.query.order_by(Document.upload_date.desc()).all()
-    return jsonify([doc.to_dict() for doc in documents])
+    """Retrieves the document list, leaving out the large summary and full text columns."""
+    rows = db.session.execute(
+        db.select(Document.id, Document.filename, Document.upload_date, Document.status, Document.model_used)
+        .order_by(Document.upload_date.desc())
+    ).all()
+    return jsonify([{
+        "id": row.id,
+        "filename": row.filename,
+        "upload_date": row.upload_date.strftime('%b %d, %Y'),
+        "status": row.status,
+        "model_used": row.model_used
+    } for row in rows])
+
+@app.route('/document/<int:doc_id>/full', methods=['GET'])
+def get_document_full(doc_id):
+    """Retrieves a single document including its summary and full text."""
+    doc = Document.query.get_or_404(doc_id)
+    return jsonify(doc.to_dict())
 
 @app.route('/history', methods=['GET'])
 def get_history():
@@ -282,16 +540,38 @@ def get_history():
 @app.route('/document/<int:doc_id>', methods=['DELETE'])
 def delete_document(doc_id):
     """Deletes a document from the database."""
-    doc = Document.query.get_or_404(doc_id)
-    db.session.delete(doc)
+    # A single DELETE ... RETURNING, so the row's large text columns are never loaded
+    deleted = db.session.execute(
+        db.delete(Document).where(Document.id == doc_id).returning(Document.filename)
+    ).first()
+    if not deleted:
+        abort(404)
     db.session.commit()
-    log_event("DELETE_DOCUMENT", doc.filename)
+    _remove_upload(doc_id) # Left behind if the document was deleted while still queued
+    log_event("DELETE_DOCUMENT", deleted.filename)
     return jsonify({"message": "Document deleted successfully."})
 
 
 # --- APPLICATION RUNNER ---
 
-if __name__ == '__main__':
+def init_db():
+    """Creates the database tables, upgrading databases made by older versions of the app."""
     with app.app_context():
         db.create_all()
-    app.run(debug=True, port=5000, threaded=False)
\ No newline at end of file
+        # create_all() skips existing tables, so add any columns and indexes missing from older databases
+        inspector = db.inspect(db.engine)
+        for table in db.metadata.sorted_tables:
+            existing_columns = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing_columns:
+                    with db.engine.begin() as connection:
+                        connection.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(db.engine.dialect)}"))
+            for index in table.indexes:
+                index.create(db.engine, checkfirst=True)
+        # Drop these connections so processes forked afterwards (e.g. Gunicorn workers) open their own
+        db.engine.dispose()
+
+if __name__ == '__main__':
+    # Development server only; in production run `gunicorn app:app` (see gunicorn.conf.py)
+    init_db()
+    app.run(debug=True, port=5000)
\ No newline at end of file
@@ -0,0 +1,14 @@
+# Gunicorn settings, picked up automatically by `gunicorn app:app`.
+# gthread workers serve several requests per process, so requests waiting on
+# Gemini or the database no longer hold up everyone else.
+bind = "0.0.0.0:5000"
+worker_class = "gthread"
+workers = 4
+threads = 8
+timeout = 120 # Without a Celery broker, /simplify waits for the whole Gemini analysis
+
+
+def on_starting(server):
+    """Creates or upgrades the database once, before any worker starts."""
+    from app import init_db
+    init_db()
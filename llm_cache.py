@@ -0,0 +1,107 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from cachetools import TTLCache
+
+DEFAULT_TTL = 3600  # Cached Gemini responses expire after one hour
+SEMANTIC_THRESHOLD = 0.92  # Minimum cosine similarity for two questions to share an answer
+
+
+def cache_key(model: str, prompt: str) -> str:
+    """Builds the cache key for a model/prompt pair."""
+    return hashlib.sha256(f"{model}\0{prompt}".encode()).hexdigest()
+
+
+class ResponseCache:
+    """Caches Gemini response text in memory, with an optional shared Redis tier."""
+
+    def __init__(self, maxsize: int = 1024, ttl: int = DEFAULT_TTL, redis_url: str | None = None):
+        self._ttl = ttl
+        self._memory = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock() # TTLCache is not thread-safe on its own
+        self._redis = None
+        if redis_url:
+            try:
+                import redis
+                self._redis = redis.Redis.from_url(redis_url)
+            except Exception as e: # from_url() does not connect, so this only catches a missing package or bad URL
+                print(f"Warning: Could not set up the Redis cache for '{redis_url}', using in-memory cache only - {e}")
+
+    def get(self, key: str) -> str | None:
+        """Returns the cached response for a key, or None on a miss."""
+        with self._lock:
+            value = self._memory.get(key)
+        if value is not None or self._redis is None:
+            return value
+
+        try:
+            raw = self._redis.get(f"llm:{key}")
+        except Exception as e:
+            print(f"Error reading from Redis cache: {e}")
+            return None
+        if raw is None:
+            return None
+
+        value = raw.decode("utf-8")
+        with self._lock:
+            self._memory[key] = value
+        return value
+
+    def set(self, key: str, value: str):
+        """Stores a response under a key in every available tier, expiring after the cache's TTL."""
+        with self._lock:
+            self._memory[key] = value
+        if self._redis is None:
+            return
+
+        try:
+            self._redis.setex(f"llm:{key}", self._ttl, value.encode("utf-8"))
+        except Exception as e:
+            print(f"Error writing to Redis cache: {e}")
+
+
+class SemanticCache:
+    """Caches answers per document and serves them for near-duplicate questions."""
+
+    def __init__(self, threshold: float = SEMANTIC_THRESHOLD, max_documents: int = 256,
+                 max_entries_per_document: int = 64):
+        self.threshold = threshold
+        self.max_documents = max_documents
+        self.max_entries_per_document = max_entries_per_document
+        self._lock = threading.Lock()
+        # scope -> (unit-normalized question embeddings as a float32 matrix, answers by row)
+        self._entries: OrderedDict[str, tuple[np.ndarray, list[str]]] = OrderedDict()
+
+    @staticmethod
+    def _normalize(embedding) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def get(self, scope: str, embedding) -> str | None:
+        """Returns the answer to the most similar cached question in a scope, if it is similar enough."""
+        query = self._normalize(embedding)
+        with self._lock:
+            entry = self._entries.get(scope)
+            if entry is None:
+                return None
+            self._entries.move_to_end(scope)
+            matrix, answers = entry
+            # Rows are pre-normalized, so one matrix-vector product yields every cosine similarity
+            similarities = np.dot(matrix, query)
+            best = int(np.argmax(similarities))
+            return answers[best] if similarities[best] > self.threshold else None
+
+    def set(self, scope: str, embedding, answer: str):
+        """Stores an answer alongside its question embedding in a scope."""
+        vector = self._normalize(embedding)
+        with self._lock:
+            matrix, answers = self._entries.pop(scope, (np.empty((0, vector.size), dtype=np.float32), []))
+            # Keep only the newest questions per document, so the matrix copied on insert stays small
+            keep = self.max_entries_per_document - 1
+            matrix, answers = (matrix[-keep:], answers[-keep:]) if keep > 0 else (matrix[:0], [])
+            self._entries[scope] = (np.vstack([matrix, vector]), answers + [answer])
+            while len(self._entries) > self.max_documents:
+                self._entries.popitem(last=False)
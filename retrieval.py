@@ -0,0 +1,92 @@
+import hashlib
+import threading
+
+import google.generativeai as genai
+import numpy as np
+from cachetools import LRUCache
+
+EMBEDDING_MODEL = 'models/text-embedding-004'
+CHUNK_CHARS = 4000  # Roughly 1k tokens, at about 4 characters per token of English text
+TOP_K_CHUNKS = 8
+EMBED_BATCH_SIZE = 100  # Most texts the API accepts in a single batch embedding request
+
+# sha256(document text) -> unit-normalized chunk embeddings, so follow-up questions skip re-embedding
+_chunk_embeddings_cache = LRUCache(maxsize=64)
+_cache_lock = threading.Lock()
+
+
+def embed_text(text: str) -> list[float] | None:
+    """Returns the query embedding for a piece of text, or None if the API call fails."""
+    try:
+        return genai.embed_content(model=EMBEDDING_MODEL, content=text, task_type="retrieval_query")["embedding"]
+    except Exception as e:
+        print(f"Error embedding text with '{EMBEDDING_MODEL}': {e}")
+        return None
+
+
+def split_into_chunks(text: str, chunk_chars: int = CHUNK_CHARS) -> list[str]:
+    """Splits text into chunks of at most chunk_chars, breaking at paragraphs or lines where possible."""
+    chunks = []
+    start = 0
+    while start < len(text):
+        end = min(start + chunk_chars, len(text))
+        if end < len(text):
+            for separator in ("\n\n", "\n", " "):
+                cut = text.rfind(separator, start + chunk_chars // 2, end)
+                if cut != -1:
+                    end = cut + len(separator)
+                    break
+        chunks.append(text[start:end])
+        start = end
+    return chunks
+
+
+def _embed_chunks(document_text: str, chunks: list[str]) -> np.ndarray | None:
+    """Returns one unit-normalized embedding row per chunk, or None if the API call fails."""
+    key = hashlib.sha256(document_text.encode("utf-8")).hexdigest()
+    with _cache_lock:
+        matrix = _chunk_embeddings_cache.get(key)
+    if matrix is not None:
+        return matrix
+
+    try:
+        vectors = []
+        for start in range(0, len(chunks), EMBED_BATCH_SIZE):
+            result = genai.embed_content(
+                model=EMBEDDING_MODEL,
+                content=chunks[start:start + EMBED_BATCH_SIZE],
+                task_type="retrieval_document"
+            )
+            vectors.extend(result["embedding"])
+    except Exception as e:
+        print(f"Error embedding document chunks with '{EMBEDDING_MODEL}': {e}")
+        return None
+
+    matrix = np.asarray(vectors, dtype=np.float32)
+    matrix /= np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+    with _cache_lock:
+        _chunk_embeddings_cache[key] = matrix
+    return matrix
+
+
+def select_relevant_text(document_text: str, query: str, query_embedding=None, top_k: int = TOP_K_CHUNKS) -> str:
+    """Cuts a long document down to the top_k chunks most relevant to a query.
+
+    Documents that already fit in top_k chunks are returned whole, as is any
+    document whose chunks or query cannot be embedded.
+    """
+    chunks = split_into_chunks(document_text)
+    if len(chunks) <= top_k:
+        return document_text
+
+    if query_embedding is None:
+        query_embedding = embed_text(query)
+    matrix = _embed_chunks(document_text, chunks) if query_embedding is not None else None
+    if matrix is None:
+        return document_text
+
+    query_vector = np.asarray(query_embedding, dtype=np.float32)
+    similarities = np.dot(matrix, query_vector / max(np.linalg.norm(query_vector), 1e-12))
+    # Keep the best chunks in their original order so the excerpt still reads top to bottom
+    best = np.sort(np.argpartition(similarities, -top_k)[-top_k:])
+    return "\n...\n".join(chunks[i] for i in best)